@@ -29,10 +29,133 @@ import CfdTools
 from CfdTools import cfdMessage
 import os
 import os.path
+import sys
 import shutil
+import tempfile
+import threading
+import hashlib
+import json
 from FreeCAD import Units
 import TemplateBuilder
 import CfdMeshRefinement
+import MeshPart
+
+
+# File in the case folder recording the settings it was written with and the files written
+CASE_HASH_FILE = ".cfdof_cache"
+
+# Properties of document objects that do not affect the written case, or whose values (object references and
+# shapes) cannot be compared between writes
+UNHASHED_PROPERTIES = {'Proxy', 'Shape', 'LinkedObjects', 'ExpressionEngine'}
+
+# Types of settings values that are hashed as they are
+if sys.version_info >= (3,):  # Python 3
+    PLAIN_TYPES = (str, bool, int, float)
+else:
+    PLAIN_TYPES = (str, unicode, bool, int, long, float)
+
+# Suffix of the folder in which a case is built before replacing the existing one
+CASE_STAGING_SUFFIX = ".staging"
+
+# Infix of the folders into which previous cases are moved to be deleted
+CASE_OLD_INFIX = ".old."
+
+# Previous case folders being deleted in the background, and those whose deletion failed
+_deleting_folders = set()
+_failed_deletions = []
+_deletion_lock = threading.Lock()
+
+# Units to which material properties are converted for OpenFOAM, and any further multiplier
+MATERIAL_UNITS = {
+    'Density': ("kg/m^3", 1.0),
+    'DynamicViscosity': ("kg/m/s", 1.0),
+    'MolarMass': ("kg/mol", 1000.0),  # OpenFOAM uses kg/kmol
+    'Cp': ("J/kg/K", 1.0),
+    'SutherlandTemperature': ("K", 1.0)
+}
+
+# Single-phase solver for each (Flow, Time) combination
+SINGLE_PHASE_SOLVERS = {
+    ('Incompressible', 'Steady'): 'simpleFoam',
+    ('Incompressible', 'Transient'): 'pimpleFoam',
+    ('Compressible', 'Steady'): 'buoyantSimpleFoam',
+    ('Compressible', 'Transient'): 'buoyantPimpleFoam',
+    ('HighMachCompressible', 'Steady'): 'hisa',
+    ('HighMachCompressible', 'Transient'): 'hisa'
+}
+
+
+def plainSettings(value):
+    """ Copy of the settings keeping only plain data, so that it serialises identically between sessions.
+    Vectors become lists and any other objects are replaced by None. """
+    if value is None or isinstance(value, PLAIN_TYPES):
+        return value
+    if isinstance(value, dict):
+        return {str(k): plainSettings(v) for k, v in value.items() if k not in UNHASHED_PROPERTIES}
+    if isinstance(value, (list, tuple, FreeCAD.Vector)):
+        return [plainSettings(v) for v in value]
+    return None
+
+
+def caseManifest(case_folder):
+    """ Record of the contents of the case folder: its sub-folders, and [relative path, size, modification time] of
+    its files excluding the hash file """
+    folders = []
+    files = []
+    for dir_path, dir_names, file_names in os.walk(case_folder):
+        rel_dir = os.path.relpath(dir_path, case_folder).replace(os.sep, '/')
+        prefix = '' if rel_dir == '.' else rel_dir + '/'
+        folders += [prefix + d for d in dir_names]
+        for f in file_names:
+            if prefix + f != CASE_HASH_FILE:
+                stat = os.stat(os.path.join(dir_path, f))
+                files.append([prefix + f, stat.st_size, stat.st_mtime])
+    return {'folders': sorted(folders), 'files': sorted(files)}
+
+
+def caseMatchesManifest(case_folder, manifest):
+    """ Whether the case folder contents are exactly as recorded by caseManifest. Any file or folder not in the
+    manifest (e.g. logs and results once the case has been run) is detected before any file is stat'ed. """
+    folders = set(manifest['folders'])
+    files = dict((f[0], f[1:]) for f in manifest['files'])
+    num_files = 0
+    for dir_path, dir_names, file_names in os.walk(case_folder):
+        rel_dir = os.path.relpath(dir_path, case_folder).replace(os.sep, '/')
+        prefix = '' if rel_dir == '.' else rel_dir + '/'
+        for d in dir_names:
+            if prefix + d not in folders:
+                return False
+        for f in file_names:
+            if prefix + f != CASE_HASH_FILE:
+                if prefix + f not in files:
+                    return False
+                num_files += 1
+    if num_files != len(files):
+        return False
+    for rel_path, (size, mtime) in files.items():
+        stat = os.stat(os.path.join(case_folder, rel_path))
+        if stat.st_size != size or stat.st_mtime != mtime:
+            return False
+    return True
+
+
+def deleteOldCase(folder):
+    """ Delete a previous case folder in the background, recording whether this failed so that it can be reported
+    and retried from the main thread """
+    errors = []
+    shutil.rmtree(folder, onerror=lambda func, path, exc_info: errors.append(path))
+    with _deletion_lock:
+        _deleting_folders.discard(folder)
+        if errors:
+            _failed_deletions.append(folder)
+
+
+def toSI(value, unit):
+    """ Convert a quantity string to a number in the given unit, bypassing the unit parser for plain numbers """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return Units.Quantity(value).getValueAs(unit).Value
 
 
 class CfdCaseWriterFoam:
@@ -49,6 +172,9 @@ class CfdCaseWriterFoam:
         self.zone_objs = CfdTools.getZoneObjects(analysis_obj)
         self.mesh_generated = False
         self.working_dir = CfdTools.getOutputPath(self.analysis_obj)
+        self.baffle_flags = None
+        # Whether the last writeCase kept the existing case as nothing had changed
+        self.case_reused = False
 
     def writeCase(self, progressCallback=None):
         """ writeCase() will collect case settings, and finally build a runnable case. """
@@ -59,10 +185,15 @@ class CfdCaseWriterFoam:
         # Perform initialisation here rather than __init__ in case of path changes
         self.case_folder = os.path.join(self.working_dir, self.solver_obj.InputCaseName)
         self.case_folder = os.path.expanduser(os.path.abspath(self.case_folder))
-        self.mesh_file_name = os.path.join(self.case_folder, self.solver_obj.InputCaseName, u".unv")
+        self.mesh_file_name = os.path.join(self.case_folder, self.solver_obj.InputCaseName + u".unv")
 
         self.template_path = os.path.join(CfdTools.get_module_path(), "data", "defaults")
 
+        # Object properties may have changed since any previous write
+        self.baffle_flags = None
+        self.doc_objects = {o.Name: o for o in self.analysis_obj.Document.Objects}
+        self.zone_parts = {id(o): tuple(r[0] for r in o.References) for o in self.zone_objs + self.porousZone_objs}
+
         # Collect settings into single dictionary
         if not self.mesh_obj:
             raise RuntimeError("No mesh object found in analysis")
@@ -70,13 +201,14 @@ class CfdCaseWriterFoam:
 
         # Validate BC labels
         bc_labels = [b.Label for b in self.bc_group]
-        for i, l in enumerate(bc_labels):
-            if bc_labels[i].find(' ') >= 0:
-                raise ValueError("Boundary condition label '" + bc_labels[i] + "' is not valid: May not contain spaces")
-        for i, l in enumerate(bc_labels):
-            for j in range(i+1, len(bc_labels)):
-                if bc_labels[j] == l:
-                    raise ValueError("Boundary condition label '" + bc_labels[i] + "' is duplicated")
+        for l in bc_labels:
+            if ' ' in l:
+                raise ValueError("Boundary condition label '" + l + "' is not valid: May not contain spaces")
+        seen_labels = set()
+        for l in bc_labels:
+            if l in seen_labels:
+                raise ValueError("Boundary condition label '" + l + "' is duplicated")
+            seen_labels.add(l)
 
         self.settings = {
             'physics': phys_settings,
@@ -88,7 +220,7 @@ class CfdCaseWriterFoam:
             'porousZonesPresent': False,
             'initialisationZones': {o.Label: CfdTools.propsToDict(o) for o in self.initialisationZone_objs},
             'initialisationZonesPresent': len(self.initialisationZone_objs) > 0,
-            'zones': {o.Label: {'PartNameList': tuple(r[0] for r in o.References)} for o in self.zone_objs},
+            'zones': {o.Label: {'PartNameList': self.zone_parts[id(o)]} for o in self.zone_objs},
             'zonesPresent': len(self.zone_objs) > 0,
             'meshType': self.mesh_obj.Proxy.Type,
             'meshDimension': self.mesh_obj.ElementDimension,
@@ -103,9 +235,6 @@ class CfdCaseWriterFoam:
         self.processFluidProperties()
         self.processBoundaryConditions()
         self.processInitialConditions()
-        self.clearCase()
-
-        self.exportZoneStlSurfaces()
         if self.porousZone_objs:
             self.processPorousZoneProperties()
         self.processInitialisationZoneProperties()
@@ -116,65 +245,87 @@ class CfdCaseWriterFoam:
             progressCallback("Matching boundary conditions ...")
         self.setupPatchNames()
 
-        TemplateBuilder.TemplateBuilder(self.case_folder, self.template_path, self.settings)
+        # Skip rewriting if nothing has changed since the case was last written, and it has not been run since
+        settings_hash = self.settingsHash()
+        self.case_reused = self.caseUnchanged(settings_hash)
+        if self.case_reused:
+            cfdMessage("Case settings unchanged; keeping existing case in folder {}\n".format(self.working_dir))
+            return True
+
+        # Build the case in a staging folder and only swap it into place once complete, so that a failed write
+        # does not leave a partially written case behind
+        staging_folder = self.clearStagingFolder()
+        self.exportZoneStlSurfaces(staging_folder)
+
+        # The templates were scanned when computing the settings hash
+        TemplateBuilder.TemplateBuilder(staging_folder, self.template_path, self.settings, scan_templates=False)
 
         # Update Allrun permission - will fail silently on Windows
-        fname = os.path.join(self.case_folder, "Allrun")
-        import stat
-        s = os.stat(fname)
-        os.chmod(fname, s.st_mode | stat.S_IEXEC)
+        fname = os.path.join(staging_folder, "Allrun")
+        try:
+            os.chmod(fname, 0o755)
+        except OSError:
+            pass
+
+        written = {'settings': settings_hash, 'manifest': caseManifest(staging_folder)}
+        with open(os.path.join(staging_folder, CASE_HASH_FILE), 'w') as f:
+            json.dump(written, f)
+
+        self.replaceCase(staging_folder)
 
         cfdMessage("Successfully wrote case to folder {}\n".format(self.working_dir))
         return True
 
+    def settingsHash(self):
+        """ Fingerprint of everything that determines the contents of the written case """
+        # Shape hash codes change whenever a shape is recomputed or reloaded, which errs on the side of rewriting
+        zone_shapes = [self.doc_objects[part_name].Shape.hashCode()
+                       for zo in self.zone_objs for part_name in self.zone_parts[id(zo)]]
+        state = [plainSettings(self.settings), TemplateBuilder.scanTemplateTree(self.template_path), zone_shapes,
+                 self.mesh_obj.STLLinearDeflection if zone_shapes else None]
+        dump = json.dumps(state, sort_keys=True)
+        return hashlib.sha256(dump.encode('utf-8')).hexdigest()
+
+    def caseUnchanged(self, settings_hash):
+        """ Whether the case folder holds exactly the files last written with these settings. Running the case
+        (Allrun modifies the case in place and writes logs and results) or editing it by hand counts as a change. """
+        try:
+            with open(os.path.join(self.case_folder, CASE_HASH_FILE)) as f:
+                written = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if not isinstance(written, dict) or written.get('settings') != settings_hash or 'manifest' not in written:
+            return False
+        return caseMatchesManifest(self.case_folder, written['manifest'])
+
     def getSolverName(self):
         """ Solver name is selected based on selected physics. This should only be extended as additional physics are
         included. """
-        solver = None
-        if self.physics_model.Phase == 'Single':
-            if len(self.material_objs) == 1:
-                if self.physics_model.Flow == 'Incompressible':
-                    if self.physics_model.Thermal == 'None':
-                        if self.physics_model.Time == 'Transient':
-                            solver = 'pimpleFoam'
-                        else:
-                            if self.porousZone_objs or self.porousBafflesPresent():
-                                solver = 'porousSimpleFoam'
-                            else:
-                                solver = 'simpleFoam'
-                    else:
-                        raise RuntimeError("Only isothermal simulation currently supported for incompressible flow.")
-                elif self.physics_model.Flow == 'Compressible':
-                    if self.physics_model.Time == 'Transient':
-                        solver = 'buoyantPimpleFoam'
-                    else:
-                        solver = 'buoyantSimpleFoam'
-                elif self.physics_model.Flow == 'HighMachCompressible':
-                    solver = 'hisa'
-                else:
-                    raise RuntimeError(self.physics_model.Flow + " flow model currently not supported.")
-            else:
+        phase = self.physics_model.Phase
+        flow = self.physics_model.Flow
+        thermal = self.physics_model.Thermal
+        time = self.physics_model.Time
+        num_materials = len(self.material_objs)
+        if phase == 'Single':
+            if num_materials != 1:
                 raise RuntimeError("Only one material object may be present for single phase simulation.")
-        elif self.physics_model.Phase == 'FreeSurface':
-            if self.physics_model.Time == 'Transient':
-                if self.physics_model.Thermal == 'None':
-                    if len(self.material_objs) == 2:
-                        solver = 'interFoam'
-                    elif len(self.material_objs) > 2:
-                        solver = 'multiphaseInterFoam'
-                    else:
-                        raise RuntimeError("At least two material objects must be present for free surface simulation.")
-                else:
-                    raise RuntimeError("Only isothermal analysis is currently supported for free surface flow simulation.")
-            else:
+            if flow == 'Incompressible' and thermal != 'None':
+                raise RuntimeError("Only isothermal simulation currently supported for incompressible flow.")
+            solver = SINGLE_PHASE_SOLVERS.get((flow, time))
+            if solver is None:
+                raise RuntimeError(flow + " flow model currently not supported.")
+            if solver == 'simpleFoam' and (self.porousZone_objs or self.porousBafflesPresent()):
+                solver = 'porousSimpleFoam'
+        elif phase == 'FreeSurface':
+            if time != 'Transient':
                 raise RuntimeError("Only transient analysis is supported for free surface flow simulation.")
+            if thermal != 'None':
+                raise RuntimeError("Only isothermal analysis is currently supported for free surface flow simulation.")
+            if num_materials < 2:
+                raise RuntimeError("At least two material objects must be present for free surface simulation.")
+            solver = 'interFoam' if num_materials == 2 else 'multiphaseInterFoam'
         else:
-            raise RuntimeError(self.physics_model.Phase + " phase model currently not supported.")
-
-        # Catch-all in case
-        if solver is None:
-            raise RuntimeError("No solver is supported to handle the selected physics with {} phases.".format(
-                len(self.material_objs)))
+            raise RuntimeError(phase + " phase model currently not supported.")
         return solver
 
     def processSolverSettings(self):
@@ -186,20 +337,67 @@ class CfdCaseWriterFoam:
 
     def processSystemSettings(self):
         system_settings = self.settings['system']
-        system_settings['FoamRuntime'] = CfdTools.getFoamRuntime()
+        runtime = CfdTools.getFoamRuntime()
+        foam_dir = CfdTools.getFoamDir()
+        system_settings['FoamRuntime'] = runtime
         system_settings['CasePath'] = self.case_folder
-        system_settings['FoamPath'] = CfdTools.getFoamDir()
-        if CfdTools.getFoamRuntime() != 'WindowsDocker':
-            system_settings['TranslatedFoamPath'] = CfdTools.translatePath(CfdTools.getFoamDir())
-
-    def clearCase(self, backup_path=None):
-        """ Remove and recreate case directory, optionally backing up """
-        output_path = self.case_folder
-        if backup_path and os.path.isdir(output_path):
-            shutil.move(output_path, backup_path)
-        if os.path.isdir(output_path):
-            shutil.rmtree(output_path)
-        os.makedirs(output_path)  # mkdir -p
+        system_settings['FoamPath'] = foam_dir
+        if runtime != 'WindowsDocker':
+            system_settings['TranslatedFoamPath'] = CfdTools.translatePath(foam_dir)
+
+    def clearStagingFolder(self):
+        """ Create an empty folder alongside the case directory in which to build the new case """
+        staging_folder = self.case_folder + CASE_STAGING_SUFFIX
+        shutil.rmtree(staging_folder, ignore_errors=True)
+        os.makedirs(staging_folder)
+        self.removeOldCases()
+        return staging_folder
+
+    def removeOldCases(self):
+        """ Remove previous cases left behind because their background deletion failed (e.g. a file was locked) or
+        did not complete (e.g. FreeCAD exited) """
+        with _deletion_lock:
+            failed = list(_failed_deletions)
+            del _failed_deletions[:]
+            in_progress = set(_deleting_folders)
+        for folder in failed:
+            cfdMessage("Deletion of previous case folder {} did not complete; retrying\n".format(folder))
+        parent = os.path.dirname(self.case_folder)
+        prefix = os.path.basename(self.case_folder) + CASE_OLD_INFIX
+        for f in os.listdir(parent):
+            folder = os.path.join(parent, f)
+            if f.startswith(prefix) and folder not in in_progress and os.path.isdir(folder):
+                shutil.rmtree(folder, ignore_errors=True)
+                if os.path.exists(folder):
+                    FreeCAD.Console.PrintWarning("Unable to delete previous case folder {}\n".format(folder))
+
+    def replaceCase(self, staging_folder):
+        """ Move the staged case into place. The previous case is moved aside and, once the new case is in place,
+        deleted in the background. """
+        if not os.path.isdir(self.case_folder):
+            os.rename(staging_folder, self.case_folder)
+            return
+        # Unique name so that deletions from successive writes cannot collide
+        old_folder = tempfile.mkdtemp(prefix=os.path.basename(self.case_folder) + CASE_OLD_INFIX,
+                                      dir=os.path.dirname(self.case_folder))
+        old_case = os.path.join(old_folder, "case")
+        try:
+            os.rename(self.case_folder, old_case)
+        except OSError:
+            os.rmdir(old_folder)
+            raise
+        try:
+            os.rename(staging_folder, self.case_folder)
+        except OSError:
+            # Restore the previous case, e.g. if the new one could not be moved in because a file is in use
+            os.rename(old_case, self.case_folder)
+            os.rmdir(old_folder)
+            raise
+        with _deletion_lock:
+            _deleting_folders.add(old_folder)
+        thread = threading.Thread(target=deleteOldCase, args=(old_folder,))
+        thread.daemon = True
+        thread.start()
 
     def setupMesh(self, updated_mesh_path, scale):
         if os.path.exists(updated_mesh_path):
@@ -209,35 +407,55 @@ class CfdCaseWriterFoam:
         # self.material_obj currently stores everything as a string
         # Convert to (mostly) SI numbers for OpenFOAM
         settings = self.settings
+        inviscid = self.physics_model.Turbulence == 'Inviscid'
         for material_obj in self.material_objs:
             mp = material_obj.Material
             mp['Name'] = material_obj.Label
-            if 'Density' in mp:
-                mp['Density'] = Units.Quantity(mp['Density']).getValueAs("kg/m^3").Value
+            for prop, (unit, factor) in MATERIAL_UNITS.items():
+                if prop in mp:
+                    if prop == 'DynamicViscosity' and inviscid:
+                        mp[prop] = 0.0
+                    else:
+                        mp[prop] = toSI(mp[prop], unit)*factor
             if 'DynamicViscosity' in mp:
-                if self.physics_model.Turbulence == 'Inviscid':
-                    mp['DynamicViscosity'] = 0.0
-                else:
-                    mp['DynamicViscosity'] = Units.Quantity(mp['DynamicViscosity']).getValueAs("kg/m/s").Value
                 mp['KinematicViscosity'] = mp['DynamicViscosity']/mp['Density']
-            if 'MolarMass' in mp:
-                # OpenFOAM uses kg/kmol
-                mp['MolarMass'] = Units.Quantity(mp['MolarMass']).getValueAs("kg/mol").Value*1000
-            if 'Cp' in mp:
-                mp['Cp'] = Units.Quantity(mp['Cp']).getValueAs("J/kg/K").Value
             if 'SutherlandTemperature' in mp:
-                mp['SutherlandTemperature'] = Units.Quantity(mp['SutherlandTemperature']).getValueAs("K").Value
                 if 'SutherlandRefViscosity' in mp and 'SutherlandRefTemperature' in mp:
-                    mu0 = Units.Quantity(mp['SutherlandRefViscosity']).getValueAs("kg/m/s").Value
-                    T0 = Units.Quantity(mp['SutherlandRefTemperature']).getValueAs("K").Value
+                    mu0 = toSI(mp['SutherlandRefViscosity'], "kg/m/s")
+                    T0 = toSI(mp['SutherlandRefTemperature'], "K")
                     mp['SutherlandConstant'] = mu0/T0**(3./2)*(T0+mp['SutherlandTemperature'])
             settings['fluidProperties'].append(mp)
+        # Invariant for the rest of the case write
+        self.alpha_names = [m['Name'] for m in settings['fluidProperties']]
+        self.is_multiphase = settings['solver']['SolverName'] == 'multiphaseInterFoam'
+        self.volume_fractions_cache = {}
+
+    def processVolumeFractions(self, volume_fractions):
+        """ Make sure the first n-1 alpha values exist, and write the n-th one consistently for
+        multiphaseInterFoam. Returns a new dictionary of volume fractions. """
+        # Many boundaries and zones share the same (often default) volume fractions
+        key = frozenset(volume_fractions.items())
+        cached = self.volume_fractions_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+        sum_alpha = 0.0
+        alphas_new = {}
+        for alpha_name in self.alpha_names[:-1]:
+            if alpha_name in volume_fractions:
+                alpha = Units.Quantity(volume_fractions[alpha_name]).Value
+            else:
+                alpha = 0.0
+            alphas_new[alpha_name] = alpha
+            sum_alpha += alpha
+        if self.is_multiphase:
+            alphas_new[self.alpha_names[-1]] = 1.0-sum_alpha
+        self.volume_fractions_cache[key] = alphas_new
+        return dict(alphas_new)
 
     def processBoundaryConditions(self):
         """ Compute any quantities required before case build """
         settings = self.settings
-        for bc_name in settings['boundaries']:
-            bc = settings['boundaries'][bc_name]
+        for bc_name, bc in settings['boundaries'].items():
             if not bc['VelocityIsCartesian']:
                 veloMag = bc['VelocityMag']
                 face = bc['DirectionFace'].split(':')
@@ -245,13 +463,13 @@ class CfdCaseWriterFoam:
                     face = bc['References'][0]
                 # See if entered face actually exists and is planar
                 try:
-                    selected_object = self.analysis_obj.Document.getObject(face[0])
+                    selected_object = self.doc_objects.get(face[0])
                     if hasattr(selected_object, "Shape"):
                         elt = selected_object.Shape.getElement(face[1])
                         if elt.ShapeType == 'Face' and CfdTools.is_planar(elt):
                             n = elt.normalAt(0.5, 0.5)
                             if bc['ReverseNormal']:
-                               n = [-ni for ni in n]
+                                n = [-ni for ni in n]
                             velocity = [ni*veloMag for ni in n]
                             bc['Ux'] = velocity[0]
                             bc['Uy'] = velocity[1]
@@ -273,20 +491,7 @@ class CfdCaseWriterFoam:
                 bc['PressureDropCoeff'] = CD*(1-beta)
 
             if settings['solver']['SolverName'] in ['interFoam', 'multiphaseInterFoam']:
-                # Make sure the first n-1 alpha values exist, and write the n-th one
-                # consistently for multiphaseInterFoam
-                sum_alpha = 0.0
-                alphas_new = {}
-                for i, m in enumerate(settings['fluidProperties']):
-                    alpha_name = m['Name']
-                    if i == len(settings['fluidProperties']) - 1:
-                        if settings['solver']['SolverName'] == 'multiphaseInterFoam':
-                            alphas_new[alpha_name] = 1.0 - sum_alpha
-                    else:
-                        alpha = Units.Quantity(bc.get('VolumeFractions', {}).get(alpha_name, '0')).Value
-                        alphas_new[alpha_name] = alpha
-                        sum_alpha += alpha
-                bc['VolumeFractions'] = alphas_new
+                bc['VolumeFractions'] = self.processVolumeFractions(bc.get('VolumeFractions', {}))
 
     def processInitialConditions(self):
         """ Do any required computations before case build. Boundary conditions must be processed first. """
@@ -296,20 +501,7 @@ class CfdCaseWriterFoam:
             mat_prop = settings['fluidProperties'][0]
             initial_values['KinematicPressure'] = initial_values['Pressure'] / mat_prop['Density']
         if settings['solver']['SolverName'] in ['interFoam', 'multiphaseInterFoam']:
-            # Make sure the first n-1 alpha values exist, and write the n-th one
-            # consistently for multiphaseInterFoam
-            sum_alpha = 0.0
-            alphas_new = {}
-            for i, m in enumerate(settings['fluidProperties']):
-                alpha_name = m['Name']
-                if i == len(settings['fluidProperties'])-1:
-                    if settings['solver']['SolverName'] == 'multiphaseInterFoam':
-                        alphas_new[alpha_name] = 1.0-sum_alpha
-                else:
-                    alpha = Units.Quantity(initial_values.get('VolumeFractions', {}).get(alpha_name, '0')).Value
-                    alphas_new[alpha_name] = alpha
-                    sum_alpha += alpha
-            initial_values['VolumeFractions'] = alphas_new
+            initial_values['VolumeFractions'] = self.processVolumeFractions(initial_values.get('VolumeFractions', {}))
 
         if initial_values['PotentialFlowP']:
             if settings['solver']['SolverName'] not in ['simpleFoam', 'porousSimpleFoam', 'pimpleFoam', 'hisa']:
@@ -389,29 +581,31 @@ class CfdCaseWriterFoam:
 
     # Zones
 
-    def exportZoneStlSurfaces(self):
+    def exportZoneStlSurfaces(self, case_folder):
+        if not self.zone_objs:
+            return
+        path = os.path.join(case_folder, "constant", "triSurface")
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # A part may be referenced by more than one zone but only needs to be written once
+        shapes = {}
         for zo in self.zone_objs:
-            for r in zo.References:
-                path = os.path.join(self.working_dir,
-                                    self.solver_obj.InputCaseName,
-                                    "constant",
-                                    "triSurface")
-                if not os.path.exists(path):
-                    os.makedirs(path)
-                fname = os.path.join(path, r[0]+u".stl")
-                import MeshPart
-                sel_obj = self.analysis_obj.Document.getObject(r[0])
-                shape = sel_obj.Shape
-                meshStl = MeshPart.meshFromShape(shape, LinearDeflection=self.mesh_obj.STLLinearDeflection)
-                meshStl.write(fname)
-                print("Successfully wrote stl surface\n")
+            for part_name in self.zone_parts[id(zo)]:
+                fname = os.path.join(path, part_name+u".stl")
+                if fname not in shapes:
+                    shapes[fname] = self.doc_objects[part_name].Shape
+        deflection = self.mesh_obj.STLLinearDeflection
+        for fname, shape in shapes.items():
+            meshStl = MeshPart.meshFromShape(shape, LinearDeflection=deflection)
+            meshStl.write(fname)
+            print("Successfully wrote stl surface\n")
 
     def processPorousZoneProperties(self):
         settings = self.settings
         settings['porousZonesPresent'] = True
         porousZoneSettings = settings['porousZones']
         for po in self.porousZone_objs:
-            pd = {'PartNameList': tuple(r[0] for r in po.References)}
+            pd = {'PartNameList': self.zone_parts[id(po)]}
             po = CfdTools.propsToDict(po)
             if po['PorousCorrelation'] == 'DarcyForchheimer':
                 pd['D'] = (po['D1'], po['D2'], po['D3'])
@@ -428,17 +622,20 @@ class CfdCaseWriterFoam:
                 d0 = po['OuterDiameter']
                 u0 = po['VelocityEstimate']
                 aspectRatio = po['AspectRatio']
-                kinVisc = self.settings['fluidProperties']['KinematicViscosity']
+                kinVisc = self.settings['fluidProperties'][0]['KinematicViscosity']
                 if kinVisc == 0.0:
                     raise ValueError("Viscosity must be set for Jakob correlation")
                 if spacing < d0:
                     raise ValueError("Tube spacing may not be less than diameter")
+                Re = u0*d0/kinVisc
+                Re_D = Re**(1.0-0.16)
+                Re_F = Re**(-0.16)
                 D = [0, 0, 0]
                 F = [0, 0, 0]
                 for (i, Sl, St) in [(0, aspectRatio*spacing, spacing), (1, spacing, aspectRatio*spacing)]:
                     C = 1.0/St*0.5*(1.0+0.47/(Sl/d0-1)**1.06)*(1.0/(1-d0/Sl))**(2.0-0.16)
-                    Di = C/d0*0.5*(u0*d0/kinVisc)**(1.0-0.16)
-                    Fi = C*(u0*d0/kinVisc)**(-0.16)
+                    Di = C/d0*0.5*Re_D
+                    Fi = C*Re_F
                     D[i] = Di
                     F[i] = Fi
                 pd['D'] = tuple(D)
@@ -451,36 +648,29 @@ class CfdCaseWriterFoam:
     def processInitialisationZoneProperties(self):
         settings = self.settings
         if settings['solver']['SolverName'] in ['interFoam', 'multiphaseInterFoam']:
-            # Make sure the first n-1 alpha values exist, and write the n-th one
-            # consistently for multiphaseInterFoam
-            for zone_name in settings['initialisationZones']:
-                z = settings['initialisationZones'][zone_name]
-                sum_alpha = 0.0
+            for zone_name, z in settings['initialisationZones'].items():
                 if 'VolumeFractions' in z:
-                    alphas_new = {}
-                    for i, m in enumerate(settings['fluidProperties']):
-                        alpha_name = m['Name']
-                        if i == len(settings['fluidProperties'])-1:
-                            if settings['solver']['SolverName'] == 'multiphaseInterFoam':
-                                alphas_new[alpha_name] = 1.0-sum_alpha
-                        else:
-                            alpha = Units.Quantity(z['VolumeFractions'].get(alpha_name, '0')).Value
-                            alphas_new[alpha_name] = alpha
-                            sum_alpha += alpha
-                    z['VolumeFractions'] = alphas_new
+                    z['VolumeFractions'] = self.processVolumeFractions(z['VolumeFractions'])
+
+    def getBaffleFlags(self):
+        """ Return whether any baffles and any porous baffles are present, scanning the boundaries only once """
+        if self.baffle_flags is None:
+            baffles = False
+            porous_baffles = False
+            for b in self.bc_group:
+                if b.BoundaryType == 'baffle':
+                    baffles = True
+                    if b.BoundarySubType == 'porousBaffle':
+                        porous_baffles = True
+                        break
+            self.baffle_flags = (baffles, porous_baffles)
+        return self.baffle_flags
 
     def bafflesPresent(self):
-        for b in self.bc_group:
-            if b.BoundaryType == 'baffle':
-                return True
-        return False
+        return self.getBaffleFlags()[0]
 
     def porousBafflesPresent(self):
-        for b in self.bc_group:
-            if b.BoundaryType == 'baffle' and \
-               b.BoundarySubType == 'porousBaffle':
-                return True
-        return False
+        return self.getBaffleFlags()[1]
 
     def setupPatchNames(self):
         print('Populating createPatchDict to update BC names')
@@ -26,16 +26,56 @@
 from __future__ import print_function
 import platform
 import os
+import codecs
+import locale
+import re
+import time
 from PySide import QtCore
-from PySide.QtCore import QProcess, QTextStream
+from PySide.QtCore import QProcess
 import FreeCAD
 import CfdTools
+if platform.system() == "Windows":
+    import WindowsJobObject
+
+
+# Start of an OpenFOAM fatal (IO) error, optionally preceded by a processor tag in parallel, or another fatal error
+ERROR_MARKER_RE = re.compile(r'^(?:(?:[^ \n]* )?--> FOAM FATAL (IO )?ERROR|(Fatal error:))', re.MULTILINE)
+
+# A line of text containing at least one character
+NONBLANK_LINE_RE = re.compile(r'[^\n]+')
+
+# Number of lines following an OpenFOAM IO error within which to look for the file it refers to
+ERROR_FILE_SEARCH_LINES = 20
+
+# Encoding of process output: native programs on Windows write in the ANSI code page
+OUTPUT_ENCODING = locale.getpreferredencoding(False) if platform.system() == "Windows" else 'utf-8'
+
+# Minimum time between GUI refreshes triggered by process output (ms)
+GUI_UPDATE_INTERVAL = 100
+
+# Time allowed for the Windows wrapper to stop the process cleanly before the whole job is terminated (ms)
+TERMINATE_TIMEOUT = 30000
+
+# Clock unaffected by changes to the system time, where available (Python 3)
+monotonicTime = getattr(time, 'monotonic', time.time)
+
+
+def splitCompleteLines(text):
+    """ Split text into the complete lines it contains (with trailing newline) and the incomplete remainder """
+    lines, sep, rest = text.rpartition('\n')
+    return lines + sep, rest
 
 
 class CfdConsoleProcess:
     """ Class to run a console process asynchronously, printing output and
     errors to the FreeCAD console and allowing clean termination in Linux
     and Windows """
+
+    # Whether to wait for the process using a polling timeout, as a failsafe against waitForFinished never
+    # returning. It has been seen not to return with processes run through the wrapper script, for reasons not
+    # established, so polling is retained on Windows where the wrapper is used.
+    poll_for_finished = platform.system() == "Windows"
+
     def __init__(self, finishedHook=None, stdoutHook=None, stderrHook=None):
         self.process = QProcess()
         self.finishedHook = finishedHook
@@ -46,6 +86,18 @@ class CfdConsoleProcess:
         self.process.readyReadStandardError.connect(self.readStderr)
         self.print_next_error_lines = 0
         self.print_next_error_file = False
+        self.print_next_error_file_budget = 0
+        self.resetOutputBuffers()
+        self.job = None  # Windows job object containing the process
+        if FreeCAD.GuiUp:
+            # Coalesces GUI refresh requests arriving in quick succession
+            self.gui_timer = QtCore.QTimer()
+            self.gui_timer.setSingleShot(True)
+            self.gui_timer.setInterval(GUI_UPDATE_INTERVAL)
+            self.gui_timer.timeout.connect(self.refreshGui)
+            self.last_gui_update = 0.0
+            # Set while refreshing the GUI, which processes events and can re-enter the output handlers
+            self._in_gui_update = False
 
     def __del__(self):
         self.terminate()
@@ -54,10 +106,12 @@ class CfdConsoleProcess:
         """ Start process and return immediately """
         self.print_next_error_lines = 0
         self.print_next_error_file = False
+        self.print_next_error_file_budget = 0
+        self.resetOutputBuffers()
         env = QtCore.QProcessEnvironment.systemEnvironment()
         if env_vars:
-            for key in env_vars:
-                env.insert(key, env_vars[key])
+            for key, value in env_vars.items():
+                env.insert(key, value)
         CfdTools.removeAppimageEnvironment(env)
         self.process.setProcessEnvironment(env)
         if working_dir:
@@ -69,6 +123,16 @@ class CfdConsoleProcess:
                    os.path.join(os.path.dirname(__file__), "WindowsRunWrapper.py")] + cmd
         print("Raw command: ", cmd)
         self.process.start(cmd[0], cmd[1:])
+        if platform.system() == "Windows" and self.process.waitForStarted():
+            # Also place the wrapper in a job object, as a last resort if it fails to stop the process cleanly.
+            # The wrapper is assigned once running, which is normally before it has started the command, but a
+            # command started before then would not be in the job.
+            try:
+                self.job = WindowsJobObject.createJobForProcess(self.process.processId())
+            except OSError as err:
+                # E.g. FreeCAD is itself in a job that does not allow nesting; fall back to killing the wrapper
+                FreeCAD.Console.PrintWarning("Unable to create job object for process: {}\n".format(err))
+                self.job = None
 
     def terminate(self):
         if self.process.state() != self.process.NotRunning:
@@ -77,44 +141,77 @@ class CfdConsoleProcess:
                 # Instead, instruct wrapper program to kill child process and itself cleanly with ctrl-break signal
                 self.process.write(b"terminate\n")
                 self.process.waitForBytesWritten()  # 'flush'
+                if self.process.waitForFinished(TERMINATE_TIMEOUT):
+                    return
+                # Note that for the WSL and Docker runtimes, this only stops the Windows side of the command
+                if self.job is not None:
+                    WindowsJobObject.terminateJob(self.job)
+                else:
+                    self.process.kill()
             else:
                 self.process.terminate()
             self.process.waitForFinished()
 
     def finished(self, exit_code):
+        if self.job is not None:
+            WindowsJobObject.closeJob(self.job)
+            self.job = None
         if self.finishedHook:
             self.finishedHook(exit_code)
 
+    def resetOutputBuffers(self):
+        # Incremental decoders so that multi-byte characters split between reads are decoded correctly
+        self.stdout_decoder = codecs.getincrementaldecoder(OUTPUT_ENCODING)('replace')
+        self.stderr_decoder = codecs.getincrementaldecoder(OUTPUT_ENCODING)('replace')
+        # Trailing incomplete line from the last read
+        self.stdout_buffer = ""
+        self.stderr_buffer = ""
+
     def readStdout(self):
         # Ensure only complete lines are passed on
-        text = ""
-        while self.process.canReadLine():
-            byteArr = self.process.readLine()
-            text += QTextStream(byteArr).readAll()
+        data = self.stdout_buffer + self.stdout_decoder.decode(bytes(self.process.readAllStandardOutput()))
+        text, self.stdout_buffer = splitCompleteLines(data)
         if text:
             print(text, end='')  # Avoid displaying on FreeCAD status bar
             if self.stdoutHook:
                 self.stdoutHook(text)
-            # Must be at the end as it can cause re-entrance
             if FreeCAD.GuiUp:
-                FreeCAD.Gui.updateGui()
+                self.requestGuiUpdate()
 
     def readStderr(self):
         # Ensure only complete lines are passed on
         # Print any error output to console
-        self.process.setReadChannel(QProcess.StandardError)
-        text = ""
-        while self.process.canReadLine():
-            byteArr = self.process.readLine()
-            text += QTextStream(byteArr).readAll()
-        self.process.setReadChannel(QProcess.StandardOutput)
+        data = self.stderr_buffer + self.stderr_decoder.decode(bytes(self.process.readAllStandardError()))
+        text, self.stderr_buffer = splitCompleteLines(data)
         if text:
             if self.stderrHook:
                 self.stderrHook(text)
             FreeCAD.Console.PrintError(text)
-            # Must be at the end as it can cause re-entrance
             if FreeCAD.GuiUp:
-                FreeCAD.Gui.updateGui()
+                self.requestGuiUpdate()
+
+    def requestGuiUpdate(self):
+        """ Refresh the GUI now unless it was refreshed within the last update interval, in which case defer the
+        refresh to the end of the interval """
+        if self._in_gui_update:
+            return
+        # The timer cannot fire while the caller is blocked in waitForFinished, so don't rely on it once the
+        # interval has passed
+        if (monotonicTime() - self.last_gui_update)*1000 >= GUI_UPDATE_INTERVAL:
+            self.gui_timer.stop()
+            self.refreshGui()
+        elif not self.gui_timer.isActive():
+            self.gui_timer.start()
+
+    def refreshGui(self):
+        if self._in_gui_update:
+            return
+        self._in_gui_update = True
+        try:
+            self.last_gui_update = monotonicTime()
+            FreeCAD.Gui.updateGui()
+        finally:
+            self._in_gui_update = False
 
     def state(self):
         return self.process.state()
@@ -123,6 +220,12 @@ class CfdConsoleProcess:
         return self.process.waitForStarted()
 
     def waitForFinished(self):
+        if not self.poll_for_finished:
+            # Output is drained by the readyRead signals, which QProcess emits while waiting
+            ret = self.process.waitForFinished(-1)
+            self.readStdout()
+            self.readStderr()
+            return ret
         # For some reason waitForFinished doesn't always return - so we resort to a failsafe timeout:
         while True:
             ret = self.process.waitForFinished(1000)
@@ -144,29 +247,54 @@ class CfdConsoleProcess:
         :param err: Standard error output, single or multiple lines
         :return: A message to be printed on console, or None
         """
+        # Most output contains no errors, so check for that cheaply before scanning lines
+        if not (self.print_next_error_lines > 0 or self.print_next_error_file or
+                'FOAM FATAL' in err or 'Fatal error:' in err):
+            return None
         ret = ""
-        errlines = err.split('\n')
-        for errline in errlines:
-            if len(errline) > 0:  # Ignore blanks
-                if self.print_next_error_lines > 0:
-                    ret += errline + "\n"
-                    self.print_next_error_lines -= 1
-                if self.print_next_error_file and "file:" in errline:
-                    ret += errline + "\n"
-                    self.print_next_error_file = False
-                words = errline.split(' ', 1)  # Split off first field for parallel
-                FATAL = "--> FOAM FATAL ERROR"
-                FATALIO = "--> FOAM FATAL IO ERROR"
-                if errline.startswith(FATAL) or (len(words) > 1 and words[1].startswith(FATAL)):
-                    self.print_next_error_lines = 1
-                    ret += "OpenFOAM fatal error:\n"
-                elif errline.startswith(FATALIO) or (len(words) > 1 and words[1].startswith(FATALIO)):
-                    self.print_next_error_lines = 1
-                    self.print_next_error_file = True
-                    ret += "OpenFOAM IO error:\n"
-                elif errline.startswith("Fatal error:"):
-                    ret += errline
+        pos = 0
+        while True:
+            if self.print_next_error_lines <= 0 and not self.print_next_error_file:
+                # Nothing pending, so skip directly to the next line containing an error marker
+                match = ERROR_MARKER_RE.search(err, pos)
+                if match is None:
+                    break
+                pos = match.start()
+            # Next non-blank line
+            line = NONBLANK_LINE_RE.search(err, pos)
+            if line is None:
+                break
+            ret += self.processErrorLine(line.group())
+            pos = line.end()
         if len(ret) > 0:
             return ret
         else:
             return None
+
+    def processErrorLine(self, errline):
+        ret = ""
+        if self.print_next_error_lines > 0:
+            ret += errline + "\n"
+            self.print_next_error_lines -= 1
+        if self.print_next_error_file:
+            if "file:" in errline:
+                ret += errline + "\n"
+                self.print_next_error_file = False
+            else:
+                # Give up if the file is not reported soon after the error
+                self.print_next_error_file_budget -= 1
+                if self.print_next_error_file_budget <= 0:
+                    self.print_next_error_file = False
+        match = ERROR_MARKER_RE.match(errline)
+        if match:
+            if match.group(2):
+                ret += errline
+            elif match.group(1):
+                self.print_next_error_lines = 1
+                self.print_next_error_file = True
+                self.print_next_error_file_budget = ERROR_FILE_SEARCH_LINES
+                ret += "OpenFOAM IO error:\n"
+            else:
+                self.print_next_error_lines = 1
+                ret += "OpenFOAM fatal error:\n"
+        return ret
@@ -27,6 +27,7 @@
 
 import FreeCAD
 import os
+import copy
 import CfdTools
 from CfdTools import addObjectProperty
 from pivy import coin
@@ -123,6 +124,19 @@ BOUNDARY_THERMALTAB = [[0], [], [1], [2, 0]]
 
 POROUS_METHODS = ['porousCoeff', 'porousScreen']
 
+# Display colour for each boundary type
+BOUNDARY_COLORS = {'wall': (0.1, 0.1, 0.1),  # Dark grey
+                   'inlet': (0.0, 0.0, 1.0),  # Blue
+                   'outlet': (1.0, 0.0, 0.0),  # Red
+                   'open': (0.0, 1.0, 1.0),  # Cyan
+                   'constraint': (0.5, 0.0, 1.0),  # Purple
+                   'baffle': (0.5, 0.0, 1.0)}  # Purple
+
+# Flattened lists of all boundary sub-types and turbulence inlet specifications (without duplicates)
+ALL_SUBTYPES = [s for subtypes in SUBTYPES for s in subtypes]
+
+ALL_TURB_SPECS = list(dict.fromkeys(s for spec in TURBULENT_INLET_SPEC.values() for s in spec[1]))
+
 
 def makeCfdFluidBoundary(name="CfdFluidBoundary"):
     obj = FreeCAD.ActiveDocument.addObject("Part::FeaturePython", name)
@@ -165,88 +179,85 @@ class _CfdFluidBoundary:
 
         self.initProperties(obj)
 
+    # Name, initial value, type, group and description of each property
+    _PROPERTY_SPEC = (
+        ('References', [], "App::PropertyPythonObject", "", "Boundary faces"),
+        ('LinkedObjects', [], "App::PropertyLinkList", "", "Linked objects"),
+        ('BoundaryType', BOUNDARY_TYPES, "App::PropertyEnumeration", "", "Boundary condition category"),
+        ('BoundarySubType', ALL_SUBTYPES, "App::PropertyEnumeration", "", "Boundary condition type"),
+        ('VelocityIsCartesian', True, "App::PropertyBool", "Flow", "Whether to use components of velocity"),
+        ('Ux', '0 m/s', "App::PropertySpeed", "Flow", "Velocity (x component)"),
+        ('Uy', '0 m/s', "App::PropertySpeed", "Flow", "Velocity (y component)"),
+        ('Uz', '0 m/s', "App::PropertySpeed", "Flow", "Velocity (z component)"),
+        ('VelocityMag', '0 m/s', "App::PropertySpeed", "Flow", "Velocity magitude"),
+        ('DirectionFace', '', "App::PropertyString", "Flow", "Face describing direction (normal)"),
+        ('ReverseNormal', False, "App::PropertyBool", "Flow", "Direction is inward-pointing if true"),
+        ('Pressure', '0 Pa', "App::PropertyPressure", "Flow", "Static pressure"),
+        ('SlipRatio', '0', "App::PropertyQuantity", "Flow", "Slip ratio"),
+        ('VolFlowRate', '0 m^3/s', "App::PropertyQuantity", "Flow", "Volume flow rate"),
+        ('MassFlowRate', '0 kg/s', "App::PropertyQuantity", "Flow", "Mass flow rate"),
+        ('PorousBaffleMethod', POROUS_METHODS, "App::PropertyEnumeration", "Baffle", "Baffle"),
+        ('PressureDropCoeff', '0', "App::PropertyQuantity", "Baffle", "Porous baffle pressure drop coefficient"),
+        ('ScreenWireDiameter', '0.2 mm', "App::PropertyLength", "Baffle", "Porous screen mesh diameter"),
+        ('ScreenSpacing', '2 mm', "App::PropertyLength", "Baffle", "Porous screen mesh spacing"),
+        ('ThermalBoundaryType', THERMAL_BOUNDARY_TYPES, "App::PropertyEnumeration", "Thermal",
+         "Type of thermal boundary"),
+        ('Temperature', '293 K', "App::PropertyQuantity", "Thermal", "Temperature"),
+        ('HeatFlux', '0 W/m^2', "App::PropertyQuantity", "Thermal", "Temperature"),
+        ('HeatTransferCoeff', '0 W/m^2/K', "App::PropertyQuantity", "Thermal", "Temperature"),
+        ('TurbulenceInletSpecification', ALL_TURB_SPECS, "App::PropertyEnumeration", "Turbulence", "Temperature"),
+        ('TurbulentKineticEnergy', '0.01 m^2/s^2', "App::PropertyQuantity", "Turbulence", "Temperature"),
+        ('SpecificDissipationRate', '1 rad/s', "App::PropertyQuantity", "Turbulence", "Temperature"),
+        ('TurbulenceIntensity', '0.1', "App::PropertyQuantity", "Turbulence", "Temperature"),
+        ('TurbulenceLengthScale', '0.1 m', "App::PropertyLength", "Turbulence", "Temperature"),
+        ('VolumeFractions', {}, "App::PropertyMap", "Volume fraction", "Volume fractions"))
+
+    # Initial selection of enumerations where it is not the first entry
+    _ENUMERATION_DEFAULTS = {'TurbulenceInletSpecification': 'intensityAndLengthScale'}
+
     def initProperties(self, obj):
-        addObjectProperty(obj, 'References', [], "App::PropertyPythonObject", "", "Boundary faces")
-        addObjectProperty(obj, 'LinkedObjects', [], "App::PropertyLinkList", "", "Linked objects")
-        addObjectProperty(obj, 'BoundaryType', BOUNDARY_TYPES, "App::PropertyEnumeration", "", "Boundary condition category")
-        all_subtypes = []
-        for s in SUBTYPES:
-            all_subtypes += s
-        addObjectProperty(obj, 'BoundarySubType', all_subtypes, "App::PropertyEnumeration", "", "Boundary condition type")
-        addObjectProperty(obj, 'VelocityIsCartesian', True, "App::PropertyBool", "Flow",
-                          "Whether to use components of velocity")
-        addObjectProperty(obj, 'Ux', '0 m/s', "App::PropertySpeed", "Flow",
-                          "Velocity (x component)")
-        addObjectProperty(obj, 'Uy', '0 m/s', "App::PropertySpeed", "Flow",
-                          "Velocity (y component)")
-        addObjectProperty(obj, 'Uz', '0 m/s', "App::PropertySpeed", "Flow",
-                          "Velocity (z component)")
-        addObjectProperty(obj, 'VelocityMag', '0 m/s', "App::PropertySpeed", "Flow",
-                          "Velocity magitude")
-        addObjectProperty(obj, 'DirectionFace', '', "App::PropertyString", "Flow",
-                          "Face describing direction (normal)")
-        addObjectProperty(obj, 'ReverseNormal', False, "App::PropertyBool", "Flow",
-                          "Direction is inward-pointing if true")
-        addObjectProperty(obj, 'Pressure', '0 Pa', "App::PropertyPressure", "Flow",
-                          "Static pressure")
-        addObjectProperty(obj, 'SlipRatio', '0', "App::PropertyQuantity", "Flow",
-                          "Slip ratio")
-        addObjectProperty(obj, 'VolFlowRate', '0 m^3/s', "App::PropertyQuantity", "Flow",
-                          "Volume flow rate")
-        addObjectProperty(obj, 'MassFlowRate', '0 kg/s', "App::PropertyQuantity", "Flow",
-                          "Mass flow rate")
-        if addObjectProperty(obj, 'PorousBaffleMethod', POROUS_METHODS, "App::PropertyEnumeration",
-                             "Baffle", "Baffle"):
-            obj.PorousBaffleMethod = 'porousCoeff'
-        addObjectProperty(obj, 'PressureDropCoeff', '0', "App::PropertyQuantity", "Baffle",
-                          "Porous baffle pressure drop coefficient")
-        addObjectProperty(obj, 'ScreenWireDiameter', '0.2 mm', "App::PropertyLength", "Baffle",
-                          "Porous screen mesh diameter")
-        addObjectProperty(obj, 'ScreenSpacing', '2 mm', "App::PropertyLength", "Baffle",
-                          "Porous screen mesh spacing")
-        addObjectProperty(obj, 'ThermalBoundaryType', THERMAL_BOUNDARY_TYPES, "App::PropertyEnumeration", "Thermal",
-                          "Type of thermal boundary")
-        addObjectProperty(obj, 'Temperature', '293 K', "App::PropertyQuantity", "Thermal",
-                          "Temperature")
-        addObjectProperty(obj, 'HeatFlux', '0 W/m^2', "App::PropertyQuantity", "Thermal",
-                          "Temperature")
-        addObjectProperty(obj, 'HeatTransferCoeff', '0 W/m^2/K', "App::PropertyQuantity", "Thermal",
-                          "Temperature")
-        all_turb_specs = []
-        for k in TURBULENT_INLET_SPEC:
-            all_turb_specs += TURBULENT_INLET_SPEC[k][1]
-        all_turb_specs = list(set(all_turb_specs))  # Remove dups
-        if addObjectProperty(obj, 'TurbulenceInletSpecification', all_turb_specs, "App::PropertyEnumeration",
-                             "Turbulence", "Temperature"):
-            obj.TurbulenceInletSpecification = 'intensityAndLengthScale'
-        addObjectProperty(obj, 'TurbulentKineticEnergy', '0.01 m^2/s^2', "App::PropertyQuantity", "Turbulence",
-                          "Temperature")
-        addObjectProperty(obj, 'SpecificDissipationRate', '1 rad/s', "App::PropertyQuantity", "Turbulence",
-                          "Temperature")
-        addObjectProperty(obj, 'TurbulenceIntensity', '0.1', "App::PropertyQuantity", "Turbulence",
-                          "Temperature")
-        addObjectProperty(obj, 'TurbulenceLengthScale', '0.1 m', "App::PropertyLength", "Turbulence",
-                          "Temperature")
-        addObjectProperty(obj, 'VolumeFractions', {}, "App::PropertyMap", "Volume fraction",
-                          "Volume fractions")
+        for spec in self._PROPERTY_SPEC:
+            self.addProperty(obj, spec)
+
+    def addProperty(self, obj, spec):
+        prop, init_val, prop_type, group, description = spec
+        # Don't share mutable initial values between objects
+        if addObjectProperty(obj, prop, copy.copy(init_val), prop_type, group, description):
+            if prop in self._ENUMERATION_DEFAULTS:
+                setattr(obj, prop, self._ENUMERATION_DEFAULTS[prop])
 
     def onDocumentRestored(self, obj):
-        self.initProperties(obj)
+        existing = set(obj.PropertiesList)
+        for spec in self._PROPERTY_SPEC:
+            prop, init_val, prop_type = spec[:3]
+            if prop not in existing or prop_type == "App::PropertyQuantity":
+                # Add properties missing from older files; quantity units are lost on load so have to be reset
+                self.addProperty(obj, spec)
+            elif prop_type == "App::PropertyEnumeration" and obj.getEnumerationsOfProperty(prop) != list(init_val):
+                # Refresh the allowed values since they have changed, keeping the current selection if still valid
+                value = getattr(obj, prop)
+                setattr(obj, prop, init_val)
+                if value in init_val:
+                    setattr(obj, prop, value)
 
     def execute(self, obj):
         """ Create compound part at recompute. """
-        docName = str(obj.Document.Name)
-        doc = FreeCAD.getDocument(docName)
-        obj.LinkedObjects = []
+        doc = obj.Document
+        linked_names = set()
+        linked_objects = []
         for ref in obj.References:
             selection_object = doc.getObject(ref[0])
             if selection_object is not None:  # May have been deleted
-                if selection_object not in obj.LinkedObjects:
-                    obj.LinkedObjects += [selection_object]
+                if selection_object.Name not in linked_names:
+                    linked_names.add(selection_object.Name)
+                    linked_objects.append(selection_object)
+        # Only assign if changed, to avoid triggering unnecessary updates
+        if [o.Name for o in obj.LinkedObjects] != [o.Name for o in linked_objects]:
+            obj.LinkedObjects = linked_objects
         shape = CfdTools.makeShapeFromReferences(obj.References, False)
         if shape is None:
-            obj.Shape = Part.Shape()
-        else:
+            shape = Part.Shape()
+        if not shape.isEqual(obj.Shape):
             obj.Shape = shape
         self.updateBoundaryColors(obj)
 
@@ -254,19 +265,7 @@ class _CfdFluidBoundary:
         if FreeCAD.GuiUp:
             vobj = obj.ViewObject
             vobj.Transparency = 20
-            if obj.BoundaryType == 'wall':
-                vobj.ShapeColor = (0.1, 0.1, 0.1)  # Dark grey
-            elif obj.BoundaryType == 'inlet':
-                vobj.ShapeColor = (0.0, 0.0, 1.0)  # Blue
-            elif obj.BoundaryType == 'outlet':
-                vobj.ShapeColor = (1.0, 0.0, 0.0)  # Red
-            elif obj.BoundaryType == 'open':
-                vobj.ShapeColor = (0.0, 1.0, 1.0)  # Cyan
-            elif (obj.BoundaryType == 'constraint') or \
-                 (obj.BoundaryType == 'baffle'):
-                vobj.ShapeColor = (0.5, 0.0, 1.0)  # Purple
-            else:
-                vobj.ShapeColor = (1.0, 1.0, 1.0)  # White
+            vobj.ShapeColor = BOUNDARY_COLORS.get(obj.BoundaryType, (1.0, 1.0, 1.0))  # Default white
 
     def __getstate__(self):
         return None
@@ -276,6 +275,9 @@ class _CfdFluidBoundary:
 
 
 class _ViewProviderCfdFluidBoundary:
+    # Task panel module, imported on first edit to keep the GUI module out of workbench start-up
+    _task_module = None
+
     def __init__(self, vobj):
         vobj.Proxy = self
 
@@ -327,8 +329,10 @@ class _ViewProviderCfdFluidBoundary:
             return False
         material_objs = CfdTools.getMaterials(analysis_object)
 
-        import _TaskPanelCfdFluidBoundary
-        taskd = _TaskPanelCfdFluidBoundary.TaskPanelCfdFluidBoundary(self.Object, physics_model, material_objs)
+        if _ViewProviderCfdFluidBoundary._task_module is None:
+            import _TaskPanelCfdFluidBoundary
+            _ViewProviderCfdFluidBoundary._task_module = _TaskPanelCfdFluidBoundary
+        taskd = self._task_module.TaskPanelCfdFluidBoundary(self.Object, physics_model, material_objs)
         for obj in FreeCAD.ActiveDocument.Objects:
             if obj.isDerivedFrom("Fem::FemMeshObject"):
                 obj.ViewObject.hide()
@@ -26,6 +26,7 @@
 # ***************************************************************************
 
 import FreeCAD
+from FreeCAD import Units
 import CfdTools
 from CfdTools import addObjectProperty
 import os
@@ -34,6 +35,22 @@ if FreeCAD.GuiUp:
     import FreeCADGui
     from PySide import QtCore
 
+# Icon for the solver command and tree view, which requests it on every redraw
+ICON_PATH = os.path.join(CfdTools.get_module_path(), "Gui", "Resources", "icons", "solver.png")
+
+# Runnable and task panel classes used to edit the solver, imported on first edit
+_task_panel_classes = None
+
+
+def getTaskPanelClasses():
+    """ Return the runnable and task panel classes, importing their modules on first use only """
+    global _task_panel_classes
+    if _task_panel_classes is None:
+        from CfdRunnableFoam import CfdRunnableFoam
+        from _TaskPanelCfdSolverControl import _TaskPanelCfdSolverControl
+        _task_panel_classes = (CfdRunnableFoam, _TaskPanelCfdSolverControl)
+    return _task_panel_classes
+
 
 def makeCfdSolverFoam(name="CfdSolver"):
     obj = FreeCAD.ActiveDocument.addObject("Part::FeaturePython", name)
@@ -45,8 +62,7 @@ def makeCfdSolverFoam(name="CfdSolver"):
 
 class _CommandCfdSolverFoam:
     def GetResources(self):
-        icon_path = os.path.join(CfdTools.get_module_path(), "Gui", "Resources", "icons", "solver.png")
-        return {'Pixmap': icon_path,
+        return {'Pixmap': ICON_PATH,
                 'MenuText': QtCore.QT_TRANSLATE_NOOP("Cfd_SolverControl", "Solver job control"),
                 'Accel': "S, C",
                 'ToolTip': QtCore.QT_TRANSLATE_NOOP("Cfd_SolverControl", "Edit properties and run solver")}
@@ -56,51 +72,46 @@ class _CommandCfdSolverFoam:
 
     def Activated(self):
         CfdTools.hide_parts_show_meshes()
-        isPresent = False
         members = CfdTools.getActiveAnalysis().Group
-        for i in members:
-            if isinstance(i.Proxy, _CfdSolverFoam):
-                FreeCADGui.activeDocument().setEdit(i.Name)
-                isPresent = True
-
-        # Allowing user to re-create if CFDSolver was deleted.
-        if not isPresent:
+        solver_obj = next((i for i in members if isinstance(getattr(i, 'Proxy', None), _CfdSolverFoam)), None)
+        if solver_obj is not None:
+            FreeCADGui.activeDocument().setEdit(solver_obj.Name)
+        else:
+            # Allowing user to re-create if CFDSolver was deleted.
             FreeCADGui.addModule("CfdTools")
             FreeCADGui.addModule("CfdSolverFoam")
             FreeCADGui.doCommand("CfdTools.getActiveAnalysis().addObject(CfdSolverFoam.makeCfdSolverFoam())")
             FreeCADGui.doCommand("Gui.activeDocument().setEdit(App.ActiveDocument.ActiveObject.Name)")
 
 
-if FreeCAD.GuiUp:
-    FreeCADGui.addCommand('Cfd_SolverControl', _CommandCfdSolverFoam())
-
-
 class _CfdSolverFoam(object):
     """ Solver-specific properties """
+
+    # Name, initial value, type, group and description of each property. Quantities are parsed once here rather
+    # than each time a solver object is created.
+    _PROPERTY_SPEC = (
+        ("InputCaseName", "case", "App::PropertyFile", "Solver",
+         "Name of case directory where the input files are written"),
+        ("Parallel", True, "App::PropertyBool", "Solver", "Parallel analysis on multiple CPU cores"),
+        ("ParallelCores", 4, "App::PropertyInteger", "Solver", "Number of cores on which to run parallel analysis"),
+        ("MaxIterations", 2000, "App::PropertyInteger", "IterationControl",
+         "Maximum number of iterations to run steady-state analysis"),
+        ("SteadyWriteInterval", 100, "App::PropertyFloat", "IterationControl", "Iteration output interval"),
+        ("ConvergenceTol", 1e-4, "App::PropertyFloat", "IterationControl",
+         "Global absolute solution convergence criterion"),
+        ("EndTime", Units.Quantity("1 s"), "App::PropertyQuantity", "TimeStepControl",
+         "Total time to run transient solution"),
+        ("TimeStep", Units.Quantity("0.001 s"), "App::PropertyQuantity", "TimeStepControl", "Time step increment"),
+        ("TransientWriteInterval", Units.Quantity("0.1 s"), "App::PropertyQuantity", "IterationControl",
+         "Iteration output interval"))
+
     def __init__(self, obj):
         self.Type = "CfdSolverFoam"
         self.Object = obj  # keep a ref to the DocObj for nonGui usage
         obj.Proxy = self  # link between App::DocumentObject to  this object
 
-        addObjectProperty(obj, "InputCaseName", "case", "App::PropertyFile", "Solver",
-                          "Name of case directory where the input files are written")
-        addObjectProperty(obj, "Parallel", True, "App::PropertyBool", "Solver",
-                          "Parallel analysis on multiple CPU cores")
-        addObjectProperty(obj, "ParallelCores", 4, "App::PropertyInteger", "Solver",
-                          "Number of cores on which to run parallel analysis")
-
-        addObjectProperty(obj, "MaxIterations", 2000, "App::PropertyInteger", "IterationControl",
-                          "Maximum number of iterations to run steady-state analysis")
-        addObjectProperty(obj, "SteadyWriteInterval", 100, "App::PropertyFloat", "IterationControl",
-                          "Iteration output interval")
-        addObjectProperty(obj, "ConvergenceTol", 1e-4, "App::PropertyFloat", "IterationControl",
-                          "Global absolute solution convergence criterion")
-        addObjectProperty(obj, "EndTime", "1 s", "App::PropertyQuantity", "TimeStepControl",
-                          "Total time to run transient solution")
-        addObjectProperty(obj, "TimeStep", "0.001 s", "App::PropertyQuantity", "TimeStepControl",
-                          "Time step increment")
-        addObjectProperty(obj, "TransientWriteInterval", "0.1 s", "App::PropertyQuantity", "IterationControl",
-                          "Iteration output interval")
+        for prop, init_val, prop_type, group, description in self._PROPERTY_SPEC:
+            addObjectProperty(obj, prop, init_val, prop_type, group, description)
 
     def execute(self, obj):
         return
@@ -109,11 +120,11 @@ class _CfdSolverFoam(object):
         return
 
     def __getstate__(self):
-        return self.Type
+        return None
 
     def __setstate__(self, state):
-        if state:
-            self.Type = state
+        # The type is fixed, so it is not saved; files from older versions store it as the state
+        self.Type = "CfdSolverFoam"
 
 
 class _ViewProviderCfdSolverFoam:
@@ -126,8 +137,7 @@ class _ViewProviderCfdSolverFoam:
     def getIcon(self):
         # """after load from FCStd file, self.icon does not exist, return constant path instead"""
         # return ":/icons/fem-solver.svg"
-        icon_path = os.path.join(CfdTools.get_module_path(), "Gui", "Resources", "icons", "solver.png")
-        return icon_path
+        return ICON_PATH
 
     def attach(self, vobj):
         self.ViewObject = vobj
@@ -144,16 +154,18 @@ class _ViewProviderCfdSolverFoam:
             FreeCADGui.activateWorkbench("CfdOFWorkbench")
         doc = FreeCADGui.getDocument(vobj.Object.Document)
         # it should be possible to find the AnalysisObject although it is not a documentObjectGroup
-        if not CfdTools.getActiveAnalysis():
+        analysis_obj = CfdTools.getActiveAnalysis()
+        if not analysis_obj:
             analysis_obj = CfdTools.getParentAnalysisObject(self.Object)
             if analysis_obj:
                 CfdTools.setActiveAnalysis(analysis_obj)
             else:
                 FreeCAD.Console.PrintError(
                     'No Active Analysis is detected from solver object in the active Document!\n')
+                return True
         if not doc.getInEdit():
-            if CfdTools.getActiveAnalysis().Document is FreeCAD.ActiveDocument:
-                if self.Object in CfdTools.getActiveAnalysis().Group:
+            if analysis_obj.Document is FreeCAD.ActiveDocument:
+                if self.Object in analysis_obj.Group:
                     doc.setEdit(vobj.Object.Name)
                 else:
                     FreeCAD.Console.PrintError('Activate the analysis this solver belongs to!\n')
@@ -164,10 +176,10 @@ class _ViewProviderCfdSolverFoam:
         return True
 
     def setEdit(self, vobj, mode):
-        if CfdTools.getActiveAnalysis():
-            from CfdRunnableFoam import CfdRunnableFoam
-            foamRunnable = CfdRunnableFoam(CfdTools.getActiveAnalysis(), self.Object)
-            from _TaskPanelCfdSolverControl import _TaskPanelCfdSolverControl
+        analysis_obj = CfdTools.getActiveAnalysis()
+        if analysis_obj:
+            CfdRunnableFoam, _TaskPanelCfdSolverControl = getTaskPanelClasses()
+            foamRunnable = CfdRunnableFoam(analysis_obj, self.Object)
             taskd = _TaskPanelCfdSolverControl(foamRunnable)
             taskd.obj = vobj.Object
 
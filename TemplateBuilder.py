@@ -27,6 +27,62 @@ import re
 import os
 
 
+# Modification time of each file, and (name, is_dir) entries of each directory, in the template trees as at their
+# last scan, keyed on normalised full path. Entries beginning with underscore are not listed as they are includes.
+_template_mtimes = {}
+_template_dirs = {}
+
+# Template file contents and the modification time they were read at, keyed on normalised full path, so that the
+# template tree is only read from disk once per session unless a file is modified
+_template_cache = {}
+
+
+def scanTemplateTree(path):
+    """ Scan the template tree, refreshing the directory listings and modification times used by readTemplateFile
+    and listTemplateDir. Returns a sorted list of [relative path, modification time] of every file, including
+    includes, by which changes to the templates can be detected. """
+    path = os.path.normpath(path)
+    for cache in (_template_mtimes, _template_dirs):
+        for key in [k for k in cache if k == path or k.startswith(path + os.sep)]:
+            del cache[key]
+    state = []
+    for dir_path, dir_names, file_names in os.walk(path):
+        _template_dirs[dir_path] = [(d, True) for d in dir_names if d[0] != '_'] + \
+                                   [(f, False) for f in file_names if f[0] != '_']
+        for f in file_names:
+            full_path = os.path.join(dir_path, f)
+            mtime = os.stat(full_path).st_mtime
+            _template_mtimes[full_path] = mtime
+            state.append([os.path.relpath(full_path, path).replace(os.sep, '/'), mtime])
+    state.sort()
+    return state
+
+
+def readTemplateFile(path):
+    """ Return the contents of the specified template file, re-reading it only if it has changed as at the last
+    scan of the template tree """
+    path = os.path.normpath(path)
+    mtime = _template_mtimes.get(path)
+    cached = _template_cache.get(path)
+    if mtime is not None and cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path) as fid:
+        contents = fid.read()
+    if mtime is not None:
+        _template_cache[path] = (mtime, contents)
+    return contents
+
+
+def listTemplateDir(path):
+    """ Return a list of (name, is_dir) for the entries of the template directory as at the last scan, ignoring
+    files beginning with underscore so they can be used as includes """
+    path = os.path.normpath(path)
+    entries = _template_dirs.get(path)
+    if entries is None:
+        entries = [(f, os.path.isdir(os.path.join(path, f))) for f in os.listdir(path) if f[0] != '_']
+    return entries
+
+
 class BracketError(ValueError):
     pass
 
@@ -37,29 +93,31 @@ class TemplateBuilder(object):
     def __init__(self,
                  case_path,
                  template_path,
-                 settings):
+                 settings,
+                 scan_templates=True):
+        """ scan_templates may be set to False if scanTemplateTree has just been called for this template path """
         if case_path[0] == "~":
             case_path = os.path.expanduser(case_path)
         self.case_path = os.path.abspath(case_path)
         self.settings = settings
         self.template_path = template_path
+        if scan_templates:
+            scanTemplateTree(template_path)
 
         self.buildDir('.')
 
     def buildDir(self, rel_dir):
         """ Recursively build files in dir (relative to case base) """
         full_dir = os.path.join(self.template_path, rel_dir)
-        for f in os.listdir(full_dir):
+        for f, is_dir in listTemplateDir(full_dir):
             rel_file = os.path.join(rel_dir, f)
-            # Ignore files beginning with underscore so they can be used as includes
-            if os.path.basename(rel_file)[0] != '_':
-                if os.path.isdir(os.path.join(self.template_path, rel_dir, f)):
-                    self.buildDir(rel_file)
-                else:
-                    contents = self.buildFile(rel_file, [])
-                    # Do not write a blank file - provides a way for optional creation of files
-                    if len(contents):
-                        self.writeToFile(rel_file, contents)
+            if is_dir:
+                self.buildDir(rel_file)
+            else:
+                contents = self.buildFile(rel_file, [])
+                # Do not write a blank file - provides a way for optional creation of files
+                if len(contents):
+                    self.writeToFile(rel_file, contents)
 
     def writeToFile(self, rel_file, contents):
         # Make sure directory tree exists
@@ -79,8 +137,8 @@ class TemplateBuilder(object):
     def buildFile(self, rel_file, params):
         """ Open the specified template file, make replacements, and return as a string """
         try:
-            fid = open(os.path.join(self.template_path, rel_file))
-        except IOError:
+            contents = readTemplateFile(os.path.join(self.template_path, rel_file))
+        except (IOError, OSError):
             # Special cases:
             # 1. Don't worry if files that end with "None" do not exist
             if rel_file.endswith("None"):
@@ -88,13 +146,11 @@ class TemplateBuilder(object):
             # 2. If a file is not found, try the same file with 'default' after the last underscore
             rel_file_default = rel_file.rsplit("_", 1)[0] + "_default"
             try:
-                fid = open(os.path.join(self.template_path, rel_file_default))
-            except IOError:
+                contents = readTemplateFile(os.path.join(self.template_path, rel_file_default))
+            except (IOError, OSError):
                 raise IOError("Error reading file {} in template path {}".format(rel_file, self.template_path))
             finally:
                 rel_file = rel_file_default
-        contents = fid.read()
-        fid.close()
         try:
             contents = self.process(contents, rel_file, params)
         except BracketError as err:
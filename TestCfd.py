@@ -35,11 +35,13 @@ import CfdMesh
 import CfdFluidBoundary
 import CfdTools
 import CfdCaseWriterFoam
+import CfdConsoleProcess
 
 import tempfile
 import unittest
 import os
 import shutil
+import random
 
 __title__ = "CFD unit test"
 __author__ = "AB, JH, OO"
@@ -57,6 +59,7 @@ __url__ = "http://www.freecadweb.org"
 # Current tests:                                                            *
 #                                                                           *
 #   * block     -   steady, incompressible flow                             *
+#   * console   -   parsing of OpenFOAM error output                        *
 #                                                                           *
 # ***************************************************************************
 
@@ -194,6 +197,33 @@ class BlockTest(unittest.TestCase):
         self.writer = CfdCaseWriterFoam.CfdCaseWriterFoam(self.analysis)
         self.writer.writeCase()
 
+    def checkCaseRewrite(self):
+        case_dir = self.writer.case_folder
+        # Writing again with nothing changed keeps the existing case
+        self.writer.writeCase()
+        self.assertTrue(self.writer.case_reused, "Unchanged case was rewritten")
+
+        # Adding a file, e.g. a log from running the case, forces a clean rewrite
+        log_file = os.path.join(case_dir, 'log.test')
+        open(log_file, 'w').close()
+        self.writer.writeCase()
+        self.assertFalse(self.writer.case_reused, "Case with added file was not rewritten")
+        self.assertFalse(os.path.exists(log_file), "Added file survived rewrite of case")
+
+        # As does modifying a file
+        control_dict = os.path.join(case_dir, 'system', 'controlDict')
+        stat = os.stat(control_dict)
+        os.utime(control_dict, (stat.st_atime, stat.st_mtime + 10))
+        self.writer.writeCase()
+        self.assertFalse(self.writer.case_reused, "Case with modified file was not rewritten")
+
+        # And changing a boundary condition
+        self.writer.writeCase()
+        self.assertTrue(self.writer.case_reused, "Unchanged case was rewritten")
+        self.outlet_boundary.Pressure = '10 Pa'
+        self.writer.writeCase()
+        self.assertFalse(self.writer.case_reused, "Case with changed boundary condition was not rewritten")
+
     def test_new_analysis(self):
         fccPrint('--------------- Start of CFD tests ---------------')
         fccPrint('Checking CFD {} analysis ...'.format(self.__class__.__doc_name))
@@ -249,6 +279,9 @@ class BlockTest(unittest.TestCase):
         self.writeCaseFiles()
         self.assertTrue(self.writer, "CfdTest of writer failed")
 
+        fccPrint('Checking {} case is only rewritten when changed ...'.format(self.__class__.__doc_name))
+        self.checkCaseRewrite()
+
         # ref_dir = os.path.join(test_file_dir, "cases", self.__class__.__doc_name)
         # case_dir = os.path.join(self.solver_object.WorkingDir, self.solver_object.InputCaseName)
         #
@@ -273,6 +306,94 @@ class BlockTest(unittest.TestCase):
         pass
 
 
+class ReferenceErrorParser:
+    """ Straightforward line-by-line implementation of CfdConsoleProcess.processErrorOutput to check it against """
+    def __init__(self):
+        self.print_next_error_lines = 0
+        self.print_next_error_file = False
+        self.print_next_error_file_budget = 0
+
+    def processErrorOutput(self, err):
+        ret = ""
+        for errline in err.split('\n'):
+            if len(errline) > 0:  # Ignore blanks
+                if self.print_next_error_lines > 0:
+                    ret += errline + "\n"
+                    self.print_next_error_lines -= 1
+                if self.print_next_error_file:
+                    if "file:" in errline:
+                        ret += errline + "\n"
+                        self.print_next_error_file = False
+                    else:
+                        self.print_next_error_file_budget -= 1
+                        if self.print_next_error_file_budget <= 0:
+                            self.print_next_error_file = False
+                words = errline.split(' ', 1)  # Split off first field for parallel
+                FATAL = "--> FOAM FATAL ERROR"
+                FATALIO = "--> FOAM FATAL IO ERROR"
+                if errline.startswith(FATAL) or (len(words) > 1 and words[1].startswith(FATAL)):
+                    self.print_next_error_lines = 1
+                    ret += "OpenFOAM fatal error:\n"
+                elif errline.startswith(FATALIO) or (len(words) > 1 and words[1].startswith(FATALIO)):
+                    self.print_next_error_lines = 1
+                    self.print_next_error_file = True
+                    self.print_next_error_file_budget = CfdConsoleProcess.ERROR_FILE_SEARCH_LINES
+                    ret += "OpenFOAM IO error:\n"
+                elif errline.startswith("Fatal error:"):
+                    ret += errline
+        if len(ret) > 0:
+            return ret
+        else:
+            return None
+
+
+class ConsoleErrorTest(unittest.TestCase):
+    __error_lines = ["--> FOAM FATAL ERROR", "--> FOAM FATAL IO ERROR", "[1] --> FOAM FATAL ERROR",
+                     "[12] --> FOAM FATAL IO ERROR: in dictionary", " --> FOAM FATAL IO ERROR",
+                     "ab  --> FOAM FATAL ERROR", "Fatal error: mesh not found", "Fatal error:", "x Fatal error:",
+                     "file: system/controlDict at line 12.", "[1] file: constant/g", "    From function main",
+                     "Time = 0.1", "", "[2]"]
+
+    def setUp(self):
+        self.process = CfdConsoleProcess.CfdConsoleProcess()
+
+    def processChunks(self, chunks):
+        return [self.process.processErrorOutput(chunk) for chunk in chunks]
+
+    def test_parallel_prefix(self):
+        ret = self.processChunks(["[3] --> FOAM FATAL ERROR: \n[3] cannot find file\n[3] \n"])
+        self.assertEqual(ret, ["OpenFOAM fatal error:\n[3] cannot find file\n"])
+
+    def test_io_error_file_in_later_chunk(self):
+        ret = self.processChunks(["[0] --> FOAM FATAL IO ERROR: \n[0] keyword missing\n",
+                                  "[0] \n[0] file: system/fvSchemes at line 20.\n"])
+        self.assertEqual(ret, ["OpenFOAM IO error:\n[0] keyword missing\n",
+                               "[0] file: system/fvSchemes at line 20.\n"])
+
+    def test_io_error_file_search_budget(self):
+        budget = CfdConsoleProcess.ERROR_FILE_SEARCH_LINES
+        filler = "".join("line {}\n".format(i) for i in range(budget - 1))
+        ret = self.processChunks(["--> FOAM FATAL IO ERROR\n" + filler, "file: found\n"])
+        self.assertEqual(ret[1], "file: found\n")
+        ret = self.processChunks(["--> FOAM FATAL IO ERROR\n" + filler + "one too many\n", "file: found\n"])
+        self.assertEqual(ret[1], None)
+
+    def test_against_reference(self):
+        rand = random.Random(1)
+        for trial in range(20000):
+            reference = ReferenceErrorParser()
+            self.process.print_next_error_lines = 0
+            self.process.print_next_error_file = False
+            self.process.print_next_error_file_budget = 0
+            for chunk in range(3):
+                lines = [rand.choice(self.__error_lines) for i in range(rand.randint(0, 30))]
+                err = "\n".join(lines) + ("\n" if rand.random() < 0.5 else "")
+                self.assertEqual(self.process.processErrorOutput(err), reference.processErrorOutput(err),
+                                 "Mismatch processing {!r}".format(err))
+                self.assertEqual((self.process.print_next_error_lines, self.process.print_next_error_file),
+                                 (reference.print_next_error_lines, reference.print_next_error_file))
+
+
 def compareInpFiles(file_name1, file_name2):
     file1 = open(file_name1, 'r')
     f1 = file1.readlines()
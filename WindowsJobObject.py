@@ -0,0 +1,70 @@
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2026 CfdOF contributors                                 *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 2 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+""" Helpers to place a process in a Windows job object, so that it and all of its descendants (e.g. MPI processes)
+can be terminated together """
+
+import ctypes
+from ctypes import wintypes
+
+PROCESS_TERMINATE = 0x0001
+PROCESS_SET_QUOTA = 0x0100
+
+kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+kernel32.CreateJobObjectW.argtypes = [wintypes.LPVOID, wintypes.LPCWSTR]
+kernel32.OpenProcess.restype = wintypes.HANDLE
+kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+kernel32.AssignProcessToJobObject.argtypes = [wintypes.HANDLE, wintypes.HANDLE]
+kernel32.TerminateJobObject.argtypes = [wintypes.HANDLE, wintypes.UINT]
+kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+
+
+def createJobForProcess(pid):
+    """ Create a job object containing the process with the given id. Any processes it subsequently starts also
+    belong to the job. Closing the job handle does not affect its processes. Returns the job handle. """
+    job = kernel32.CreateJobObjectW(None, None)
+    if not job:
+        raise ctypes.WinError(ctypes.get_last_error())
+    try:
+        process = kernel32.OpenProcess(PROCESS_SET_QUOTA | PROCESS_TERMINATE, False, pid)
+        if not process:
+            raise ctypes.WinError(ctypes.get_last_error())
+        try:
+            if not kernel32.AssignProcessToJobObject(job, process):
+                raise ctypes.WinError(ctypes.get_last_error())
+        finally:
+            kernel32.CloseHandle(process)
+    except OSError:
+        kernel32.CloseHandle(job)
+        raise
+    return job
+
+
+def terminateJob(job, exit_code=1):
+    """ Terminate all processes in the job """
+    kernel32.TerminateJobObject(job, exit_code)
+
+
+def closeJob(job):
+    """ Close the job handle """
+    kernel32.CloseHandle(job)